@@ -20,6 +20,7 @@
 # https://github.com/siemens/codeface/blob/master/codeface/util.py
 
 from __future__ import absolute_import
+import functools
 import logging
 import os
 import os.path
@@ -29,6 +30,7 @@ import traceback
 import unicodedata
 from threading import enumerate as threading_enumerate
 from ftfy import fix_encoding
+from ftfy.badness import is_bad
 
 def setup_logging(level=logging.INFO):
     logging.basicConfig(
@@ -59,16 +61,28 @@ def gen_range_path(base_path, i, start_rev, end_rev):
     return(os.path.join(base_path, "{0}--{1}-{2}".
                         format(str(i).zfill(3), start_rev, end_rev)))
 
+# unicode characters from the "Specials" block and all four-byte-encoded unicode characters
+# see: https://www.compart.com/en/unicode/block/U+FFF0
+_SPECIALS_RE = re.compile(u"[\ufff0-\uffff\U00010000-\U0010ffff]")
+
+# translation table mapping all kinds of control characters of the BMP to " "
+# (all others are four-byte-encoded and, hence, replaced via _SPECIALS_RE anyway)
+# see: https://www.fileformat.info/info/unicode/category/index.htm
+_CONTROL_TRANSLATE = {cp: u" " for cp in range(0x10000) if unicodedata.category(chr(cp))[0] == "C"}
+
+# control characters within the ASCII range (i.e., all ASCII characters of unicode category "C")
+_ASCII_CONTROL_RE = re.compile(u"[\x00-\x1f\x7f]")
+
 def encode_as_utf8(string):
     """
     Encode the given string properly in UTF-8,
-    independent from its internal representation (str or unicode).
+    independent from its internal representation (str or bytes).
 
     This function removes any control characters and four-byte-encoded unicode characters and replaces them
     with " ". (Four-byte-encoded unicode characters do not work with 'utf8' encoding of MySQL.)
 
     :param string: any string
-    :return: the UTF-8 encoded string of type str
+    :return: the UTF-8 encoded string of type bytes
     """
 
     # Normalize to str first
@@ -83,29 +97,32 @@ def encode_as_utf8(string):
         # not string-like, return as-is
         return string
 
-    # convert to real unicode-utf8 encoded string, fix_text ensures proper encoding
-    new_string = fix_encoding(text)
-
-    # remove unicode characters from "Specials" block
-    # see: https://www.compart.com/en/unicode/block/U+FFF0
-    new_string = re.sub(r"\ufff.", " ", new_string)
+    return _encode_text_as_utf8(text)
 
-    # remove all kinds of control characters and emojis
-    # see: https://www.fileformat.info/info/unicode/category/index.htm
-    new_string = u"".join(ch if unicodedata.category(ch)[0] != "C" else " " for ch in new_string)
+# names, e-mail addresses, and file paths occur over and over again, so cache the results
+@functools.lru_cache(maxsize=65536)
+def _encode_text_as_utf8(text):
+    """
+    Encode the given str in UTF-8 as described in 'encode_as_utf8'.
 
-    new_string = new_string.encode("utf-8")
+    :param text: any str
+    :return: the UTF-8 encoded string of type bytes
+    """
 
-    # replace any 4-byte characters with a single space (previously: four_byte_replacement)
-    try:
-        # UCS-4 build
-        four_byte_regex = re.compile(u"[\U00010000-\U0010ffff]")
-    except re.error:
-        # UCS-2 build
-        four_byte_regex = re.compile(u"[\uD800-\uDBFF][\uDC00-\uDFFF]")
+    # pure ASCII strings cannot be broken in their encoding and need no further treatment
+    # if they do not contain any control characters
+    if text.isascii() and not _ASCII_CONTROL_RE.search(text):
+        return text.encode("ascii")
 
-    four_byte_replacement = r" "  # r":4bytereplacement:"
-    new_string = four_byte_regex.sub(four_byte_replacement, new_string.decode("utf-8")).encode("utf-8")
+    # convert to real unicode-utf8 encoded string, fix_text ensures proper encoding
+    # (only needed if the text looks like mojibake, which is rarely the case)
+    if is_bad(text):
+        new_string = fix_encoding(text)
+    else:
+        new_string = text
 
-    return str(new_string)
+    # replace "Specials" and four-byte characters (previously: four_byte_replacement) in one pass,
+    # then remove all kinds of control characters and emojis
+    new_string = _SPECIALS_RE.sub(u" ", new_string).translate(_CONTROL_TRANSLATE)
 
+    return new_string.encode("utf-8")
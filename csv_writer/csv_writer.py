@@ -23,23 +23,26 @@ This file provides the needed functions for standardized CSV writing
 
 import csv
 
+# sizes of the file buffers used for writing (8 MiB) and reading (1 MiB) csv files
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+READ_BUFFER_SIZE = 1024 * 1024
 
-def write_to_csv(file_path, lines, append=False):
+
+def write_to_csv(file_path, lines, append=False, quoting=csv.QUOTE_NONNUMERIC):
     """
     Write the given lines to the file with the given file path.
 
     :param file_path: The path where the file shall be written
     :param lines: The lines that shall be written in the file
     :param append: Flag if lines shall be appended to file or overwrite file
+    :param quoting: The quoting strategy of the csv writer (use 'csv.QUOTE_MINIMAL' if all columns are strings)
     """
 
     open_mode = "a" if append else "w"
 
-    with open(file_path, mode=open_mode, encoding="utf-8") as csv_file:
-        wr = csv.writer(csv_file, delimiter=';', lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
-        # encode in proper UTF-8 before writing to file
-        for line in lines:
-            wr.writerow(line)
+    with open(file_path, mode=open_mode, encoding="utf-8", newline="", buffering=WRITE_BUFFER_SIZE) as csv_file:
+        wr = csv.writer(csv_file, delimiter=';', lineterminator='\n', quoting=quoting)
+        wr.writerows(lines)
 
 def read_from_csv(file_path, delimiter=";"):
     """
@@ -50,5 +53,6 @@ def read_from_csv(file_path, delimiter=";"):
 
     :return: A list containing the lines of the read file
     """
-    content = csv.reader(open(file_path), delimiter=delimiter)
-    return list(content)
+    with open(file_path, mode="r", encoding="utf-8", newline="", buffering=READ_BUFFER_SIZE) as csv_file:
+        content = csv.reader(csv_file, delimiter=delimiter)
+        return list(content)
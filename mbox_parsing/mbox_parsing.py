@@ -23,20 +23,20 @@ This file is able to extract artifact occurrences in e-mail within mbox files.
 """
 
 import argparse
+import collections
 import csv
+import itertools
 import mailbox
-import multiprocessing
+import mmap
+import os
 import os.path
-import shutil
+import re
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from os.path import abspath
 from logging import getLogger
 
-from joblib import Parallel, delayed
-from whoosh import index  # import create_in, open_dir, exists_in
-from whoosh.analysis import StandardAnalyzer
-from whoosh.fields import Schema, TEXT, ID
-from whoosh.qparser import QueryParser
+import ahocorasick
 
 from codeface_utils.configuration import Configuration
 from csv_writer import csv_writer
@@ -45,44 +45,47 @@ from csv_writer import csv_writer
 setup_logging()
 log = getLogger(__name__)
 
-def __get_index(mbox, mbox_path, results_folder, schema, reindex):
-    """Initialize the search index (and create it, if needed
+# tokens of e-mail bodies and artifacts: split by whitespace, commas, colons, and quotation marks
+__TOKEN_REGEX = re.compile(r"[^\s,:\"']+")
 
-    :param mbox: the mbox object to create the index for
-    :param mbox_path: the path to the mbox object on disk
-    :param results_folder: the folder to create the index folder in
-    :param schema: the schema for the to be created index
-    :param reindex: force reindexing if True
-    :return: the opened index object
-    """
+# tokens which are ignored when searching (same as for the Whoosh full-text search used before)
+__STOP_WORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "for", "from", "have", "if", "in", "is", "it", "may",
+    "not", "of", "on", "or", "tbd", "that", "the", "this", "to", "us", "we", "when", "will", "with", "yet", "you",
+    "your"
+])
 
-    # create or load index:
-    # 0) construct index path
-    index_path = os.path.join(results_folder, "mbox-index", os.path.basename(mbox_path))
-    # 1) if reindexing, remove the index folder
-    if os.path.exists(index_path) and reindex:
-        log.info("Removing index from path '{}'...".format(index_path))
-        shutil.rmtree(index_path)
-    # 2) Check if we need to create the index for Whoosh full-text search
-    log.info("Checking for index in results folder...")
-    if (not os.path.exists(index_path)) or (not index.exists_in(index_path)):
-        # 2.1) create index
-        log.info("Creating index for text search in results folder.")
-        os.makedirs(index_path)  # create path
-        index.create_in(index_path, schema)  # initialize as index path
-        ix = index.open_dir(index_path)  # open as index path
-        writer = ix.writer()
-        # add all messages to index
-        for message in mbox:
-            writer.add_document(messageID=str(message['message-id']), content=__mbox_getbody(message))
-        writer.commit()
-        log.info("Index created, parsing will begin now.")
-    else:
-        # 2.2) load index
-        log.info("Index has already been created, parsing will begin right away.")
-        ix = index.open_dir(index_path)
+# the columns of the 'commits.list' file
+__COMMIT_DATA_COLUMNS = [
+    "commit.id",  # id
+    "date", "author.name", "author.email",  # author information
+    "committer.date", "committer.name", "committer.email",  # committer information
+    "hash", "changed.files", "added.lines", "deleted.lines", "diff.size",  # commit information
+    "file", "artifact", "artifact.type", "artifact.diff.size"  # commit-dependency information
+]
+__FILE_INDEX = __COMMIT_DATA_COLUMNS.index("file")
+__ARTIFACT_INDEX = __COMMIT_DATA_COLUMNS.index("artifact")
+
+# minimum length of tokens which are not ignored when searching
+__MIN_TOKEN_LENGTH = 2
+
+# number of messages searched for at once in a worker process
+__MESSAGES_PER_CHUNK = 1000
+
+# the automaton and queries to search with in a worker process (see '__init_search')
+__search_state = None
 
-    return ix
+
+def __normalize_text(text):
+    """Normalize the given text for searching: Split it into lower-case tokens, ignore stop words and
+    too short tokens, and join the remaining tokens by single spaces.
+
+    :param text: the text to normalize
+    :return: the normalized text
+    """
+
+    tokens = (token.lower() for token in __TOKEN_REGEX.findall(text))
+    return " ".join(token for token in tokens if len(token) >= __MIN_TOKEN_LENGTH and token not in __STOP_WORDS)
 
 
 # get the search terms from the commits.list file
@@ -94,22 +97,24 @@ def __get_artifacts(results_folder, files_as_artifacts):
     :return: a set of tuples (file name, artifact)
     """
 
-    commit_data_columns = [
-        "commit.id",  # id
-        "date", "author.name", "author.email",  # author information
-        "committer.date", "committer.name", "committer.email",  # committer information
-        "hash", "changed.files", "added.lines", "deleted.lines", "diff.size",  # commit information
-        "file", "artifact", "artifact.type", "artifact.diff.size"  # commit-dependency information
-    ]
-
     commit_set = set()
-    with open(os.path.join(results_folder, "commits.list"), 'r') as commit_file:
-        commit_list = csv.DictReader(commit_file, delimiter=';', fieldnames=commit_data_columns)
+    # the same files occur in many commits, so compute their base names only once
+    base_names = {}
+    with open(os.path.join(results_folder, "commits.list"), 'r', newline='',
+              buffering=csv_writer.READ_BUFFER_SIZE) as commit_file:
+        commit_list = csv.reader(commit_file, delimiter=';')
         for row in commit_list:
+            # skip empty or incomplete lines
+            if len(row) <= __ARTIFACT_INDEX:
+                continue
+            file_name = row[__FILE_INDEX]
             if files_as_artifacts:
-                commit_set.add((row["file"], os.path.basename(row["file"])))
+                base_name = base_names.get(file_name)
+                if base_name is None:
+                    base_name = base_names[file_name] = os.path.basename(file_name)
+                commit_set.add((file_name, base_name))
             else:
-                commit_set.add((row["file"], row["artifact"]))
+                commit_set.add((file_name, row[__ARTIFACT_INDEX]))
 
     return commit_set
 
@@ -121,102 +126,215 @@ def __mbox_getbody(message):
     :return: the unicode-encoded message body
     """
 
-    __text_indicator = "text/"
+    # 'walk' already yields all (nested) parts of a multipart message, so walk only once
+    parts = message.walk() if message.is_multipart() else (message,)
 
-    body = None
-    if message.is_multipart():
-        for part in message.walk():
-            if part.is_multipart():
-                for subpart in part.walk():
-                    if __text_indicator in subpart.get_content_type().lower():
-                        body = subpart.get_payload(decode=True)
-            elif __text_indicator in part.get_content_type().lower():
-                body = part.get_payload(decode=True)
-    elif __text_indicator in message.get_content_type().lower():
-        body = message.get_payload(decode=True)
+    # take the first text part
+    for part in parts:
+        if part.get_content_maintype() == "text":
+            body = part.get_payload(decode=True)
+            if body is not None:
+                charset = part.get_content_charset() or "utf-8"
+                try:
+                    return body.decode(charset, errors="replace")
+                except LookupError:
+                    # unknown charset declared in the message
+                    return body.decode("utf-8", errors="replace")
 
-    if body is None:
-        log.info(message.get_content_type())
-        log.info(
-            "An image or some other content has been found that cannot be indexed. Message is given an empty body.")
-        body = ' '
+    log.info(message.get_content_type())
+    log.info(
+        "An image or some other content has been found that cannot be indexed. Message is given an empty body.")
 
-    return str(body, errors="replace")
+    return " "
 
 
-def __parse_execute(artifact, schema, my_index, include_filepath):
-    """ Execute the search for the given commit
+def __get_queries(artifacts, include_filepath):
+    """Construct the search queries for the given artifacts
 
-    :param artifact: the (file name, artifact) tuple to search for
-    :param schema: the search schema to use
-    :param my_index: the search index to use
+    :param artifacts: the set of (file name, artifact) tuples to search for
     :param include_filepath: indicator whether to use the 'file name' part of the artifact into account
+    :return: a list of queries, i.e., tuples (phrases, artifact, file names), where all (normalized) phrases need
+             to occur in an e-mail to match the query, and a dict mapping each phrase to the indices of its queries
+    """
+
+    # deduplicate queries, as many files may share the same artifact (if the file name is not searched for)
+    file_names_per_query = collections.defaultdict(list)
+    for (file_name, artifact) in artifacts:
+        query_key = (file_name, artifact) if include_filepath else artifact
+        file_names_per_query[query_key].append(file_name)
+
+    queries = []
+    queries_per_phrase = collections.defaultdict(list)
+    for query_key, file_names in file_names_per_query.items():
+        if include_filepath:
+            file_name, artifact = query_key
+            phrases = {__normalize_text(file_name), __normalize_text(artifact)}
+        else:
+            artifact = query_key
+            phrases = {__normalize_text(artifact)}
+        # phrases without any token cannot be searched for and, hence, are ignored
+        phrases = tuple(phrase for phrase in phrases if phrase)
+        if not phrases:
+            continue
+
+        for phrase in phrases:
+            queries_per_phrase[phrase].append(len(queries))
+        queries.append((phrases, artifact, file_names))
+
+    return queries, queries_per_phrase
+
+
+def __get_automaton(phrases):
+    """Construct the Aho-Corasick automaton to search for all of the given phrases at once
+
+    :param phrases: the (normalized) phrases to search for
+    :return: the automaton, or None if there are no phrases to search for
+    """
+
+    if not phrases:
+        return None
+
+    automaton = ahocorasick.Automaton()
+    for phrase in phrases:
+        automaton.add_word(phrase, phrase)
+    automaton.make_automaton()
+
+    return automaton
+
+
+def __get_search(results_folder, include_filepath, files_as_artifacts):
+    """Construct the search for the artifacts from the results folder
+
+    :param results_folder: the results folder with the file 'commits.list'
+    :param include_filepath: indicator whether to use the 'file name' part of the artifact into account
+    :param files_as_artifacts: indicator whether to search for files (base names) as artifacts
+    :return: a tuple of the automaton, the queries, and the queries per phrase (see '__get_queries')
+    """
+
+    # extract artifacts from results folder
+    artifacts = __get_artifacts(results_folder, files_as_artifacts)
+
+    # construct queries and an automaton to search for all of them in one pass over each message
+    queries, queries_per_phrase = __get_queries(artifacts, include_filepath)
+    automaton = __get_automaton(queries_per_phrase.keys())
+
+    return automaton, queries, queries_per_phrase
+
+
+def __parse_message(message, automaton, queries, queries_per_phrase):
+    """ Execute the search for all queries in the given message
+
+    :param message: the mbox message to search in
+    :param automaton: the Aho-Corasick automaton containing all phrases of the queries
+    :param queries: the list of queries (see '__get_queries')
+    :param queries_per_phrase: the dict mapping each phrase to the indices of its queries
     :return: a match list of tuples (file name, artifact, message ID)
     """
 
-    log.info("Searching for artifact ({}, {})...".format(artifact[0], artifact[1]))
+    body = __normalize_text(__mbox_getbody(message))
+
+    # find all phrases in the body, which start and end at token boundaries
+    found_phrases = set()
+    for end, phrase in automaton.iter(body):
+        start = end - len(phrase) + 1
+        if (start == 0 or body[start - 1] == " ") and (end + 1 == len(body) or body[end + 1] == " "):
+            found_phrases.add(phrase)
 
+    # check which queries are matched, i.e., for which all phrases have been found
+    matched_queries = set()
+    for phrase in found_phrases:
+        for query_index in queries_per_phrase[phrase]:
+            if all(query_phrase in found_phrases for query_phrase in queries[query_index][0]):
+                matched_queries.add(query_index)
+
+    # construct result for all files the matched artifacts belong to
     result = []
+    message_id = str(message['message-id'])
+    for query_index in matched_queries:
+        _, artifact, file_names = queries[query_index]
+        for file_name in file_names:
+            result_tuple = (file_name, artifact, message_id)
+            result.append(result_tuple)
 
-    with my_index.searcher() as searcher:
-        # initialize query parser
-        query_parser = QueryParser("content", schema=schema)
+    return result
 
-        # construct query
-        if include_filepath:
-            my_query = query_parser.parse('"%s" AND "%s"' % (artifact[0], artifact[1]))
-        else:
-            my_query = query_parser.parse("\"%s\"" % artifact[1])
 
-        # search!
-        query_result = searcher.search(my_query, terms=True, optimize=False, limit=None)
+def __init_search(automaton, queries, queries_per_phrase):
+    """Initialize the search state of a worker process, so that it is only transferred once per process
 
-        # construct result from query answer
-        for r in query_result:
-            result_tuple = (artifact[0], artifact[1], r["messageID"])
-            result.append(result_tuple)
+    :param automaton: the Aho-Corasick automaton containing all phrases of the queries
+    :param queries: the list of queries (see '__get_queries')
+    :param queries_per_phrase: the dict mapping each phrase to the indices of its queries
+    """
+
+    global __search_state
+    __search_state = (automaton, queries, queries_per_phrase)
+
+
+def __parse_messages(mbox_path, offsets):
+    """ Execute the search for all queries in the messages at the given positions of the mbox file
+
+    :param mbox_path: the path to the mbox file on disk
+    :param offsets: the list of (start, stop) byte offsets of the messages to search in
+    :return: a match list of tuples (file name, artifact, message ID)
+    """
+
+    automaton, queries, queries_per_phrase = __search_state
+
+    result = []
+    with open(mbox_path, "rb") as mbox_file, \
+            mmap.mmap(mbox_file.fileno(), 0, access=mmap.ACCESS_READ) as mbox_data:
+        for (start, stop) in offsets:
+            message = mailbox.mboxMessage(mbox_data[start:stop])
+            result.extend(__parse_message(message, automaton, queries, queries_per_phrase))
 
     return result
 
 
-def parse(mbox_name, results_folder, include_filepath, files_as_artifacts, reindex, append_result):
+def __parse_mbox(mbox_path, offsets, automaton, queries, queries_per_phrase):
+    """ Execute the search for all queries in the messages at the given positions of the mbox file,
+    using parallel processes
+
+    :param mbox_path: the path to the mbox file on disk
+    :param offsets: the list of (start, stop) byte offsets of the messages to search in
+    :param automaton: the Aho-Corasick automaton containing all phrases of the queries
+    :param queries: the list of queries (see '__get_queries')
+    :param queries_per_phrase: the dict mapping each phrase to the indices of its queries
+    :return: a generator of tuples (file name, artifact, message ID), yielding the matches of each chunk of
+             messages as soon as it has been searched (in no particular order)
+    """
+
+    chunks = [offsets[i:i + __MESSAGES_PER_CHUNK] for i in range(0, len(offsets), __MESSAGES_PER_CHUNK)]
+    num_procs = min(os.cpu_count() or 1, len(chunks))
+
+    with ProcessPoolExecutor(max_workers=num_procs, initializer=__init_search,
+                             initargs=(automaton, queries, queries_per_phrase)) as executor:
+        # do not keep references to the futures, so that the results can be freed once they are consumed
+        for future in as_completed([executor.submit(__parse_messages, mbox_path, chunk) for chunk in chunks]):
+            yield from future.result()
+
+
+def parse(mbox_name, results_folder, include_filepath, files_as_artifacts, append_result, search=None):
     """Parse the given mbox file with the commit information from the results folder.
 
     :param mbox_name: the mbox file to search in
-    :param results_folder: the results folder for index and commit information
+    :param results_folder: the results folder for commit information
     :param include_filepath: indicator whether to use the 'file name' part of the artifact into account
     :param files_as_artifacts: indicator whether to search for files (base names) as artifacts
-    :param reindex: force reindexing if True
     :param append_result: flag whether to append the results for the current mbox file to the output file
+    :param search: the search to use (see '__get_search'), constructed from the results folder if not given
     """
 
     # load mbox file
     mbox = mailbox.mbox(mbox_name)
 
-    # create schema for text search
-    analyzer = StandardAnalyzer(expression=r"[^\s,:\"']+")  # split by whitespace, commas, colons, and quotation marks.
-    schema = Schema(messageID=ID(stored=True), content=TEXT(analyzer=analyzer))
-
-    # create/load index (initialize if necessary)
-    ix = __get_index(mbox, mbox_name, results_folder, schema, reindex)
-
-    # extract artifacts from results folder
-    artifacts = __get_artifacts(results_folder, files_as_artifacts)
-
-    # parallelize execution call for the text search
-    log.info("Start parsing...")
-    num_cores = multiprocessing.cpu_count()
-    csv_data = Parallel(n_jobs=num_cores - 1)(
-        delayed(__parse_execute)(commit, schema, ix, include_filepath) for commit in artifacts)
-    log.info("Parsing finished.")
+    # construct the search for the artifacts from the results folder (if not given)
+    if search is None:
+        search = __get_search(results_folder, include_filepath, files_as_artifacts)
+    automaton, queries, queries_per_phrase = search
 
-    # re-arrange results
-    result = []
-    if not append_result:
-        result.append(('file', 'artifact', 'messageID'))
-    for entry in csv_data:
-        for row in entry:
-            result.append(row)
+    # get the byte offsets of all messages in the mbox file (the table of contents is not exposed publicly)
+    offsets = [mbox._toc[key] for key in mbox.keys()]
 
     # determine ouput file
     filename = "mboxparsing"
@@ -228,9 +346,18 @@ def parse(mbox_name, results_folder, include_filepath, files_as_artifacts, reind
         filename += ".list"
     output_file = os.path.join(results_folder, filename)
 
-    # Writes found hits to file.
-    log.info("Writing results to file {}.".format(output_file))
-    csv_writer.write_to_csv(output_file, result, append=append_result)
+    header = []
+    if not append_result:
+        header.append(('file', 'artifact', 'messageID'))
+
+    # search all messages and write found hits to file right away
+    # (all columns are strings, so there is no need to check for numeric values when quoting)
+    log.info("Start parsing, writing results to file {}...".format(output_file))
+    hits = []
+    if automaton is not None and offsets:
+        hits = __parse_mbox(mbox_name, offsets, automaton, queries, queries_per_phrase)
+    csv_writer.write_to_csv(output_file, itertools.chain(header, hits), append=append_result,
+                            quoting=csv.QUOTE_MINIMAL)
 
     log.info("Parsing mbox file complete!")
 
@@ -244,7 +371,8 @@ def run():
     parser.add_argument('-p', '--project', help="Project configuration file", required=True)
     parser.add_argument('-f', '--filepath', help="Include the filepath in the search", action="store_true")
     parser.add_argument('--file', help="Use files (reps. their base names) as artifacts", action="store_true")
-    parser.add_argument('-r', '--reindex', help="Re-construct the index", action="store_true")
+    parser.add_argument('-r', '--reindex', help="Deprecated: there is no index anymore, this option has no effect",
+                        action="store_true")
     parser.add_argument('resdir', help="Directory to store analysis results in")
     parser.add_argument('maildir', help='Directory in which the mailinglists are located')
 
@@ -258,6 +386,17 @@ def run():
     __conf = Configuration.load(__codeface_conf, __project_conf)
     __resdir_project = os.path.join(__resdir, __conf["project"], __conf["tagging"])
 
+    # the mbox files are not indexed anymore, so reindexing is not needed
+    if args.reindex:
+        log.warning("The option '--reindex' is deprecated and has no effect, as there is no search index anymore.")
+    index_path = os.path.join(__resdir_project, "mbox-index")
+    if os.path.exists(index_path):
+        log.info("The search index folder '{}' of previous runs is not used anymore and can be deleted."
+                 .format(index_path))
+
+    # all mailing lists are searched for the same artifacts, so construct the search only once
+    search = __get_search(__resdir_project, args.filepath, args.file)
+
     # search the mailing lists
     for ml in __conf["mailinglists"]:
         mbox_file = os.path.join(__maildir, ml["name"] + ".mbox")
@@ -265,7 +404,7 @@ def run():
         # append results for all but the first mailing list
         append_result = ml != __conf["mailinglists"][0]
 
-        parse(mbox_file, __resdir_project, args.filepath, args.file, args.reindex, append_result)
+        parse(mbox_file, __resdir_project, args.filepath, args.file, append_result, search)
 
 
 if __name__ == "__main__":
@@ -18,4 +18,6 @@
 
 import mbox_parsing.mbox_parsing as parsing
 
-parsing.run()
+# guard the entry point, as the parsing spawns worker processes which may re-import this script
+if __name__ == "__main__":
+    parsing.run()